@@ -3,10 +3,13 @@
 RabbitMQ backup & restore (duplicate‑friendly) + offline de‑duplication tool
 ===========================================================================
 * **export** – *non‑destructive*: pulls messages with `ack_requeue_true`, so the
-  source queue залишається неушкодженою. У файлі **можуть бути дублікати**.
+  source queue залишається неушкодженою. У файлі **можуть бути дублікати**,
+  якщо не вказати `--dedup` (тоді дублікати відкидаються одразу при експорті).
 * **dedup**  – новий режим. Проганяє *один* `.jsonl.gz` файл і прибирає всі
-  дублікати (визначає по `message_id`, фолбек SHA‑256 тіла). Можна або
+  дублікати (визначає по `message_id`, фолбек BLAKE3/BLAKE2b‑128 тіла). Можна або
   перезаписати файл in‑place (`--inplace`), або створити `*.dedup.jsonl.gz`.
+  Кілька файлів можна чистити один проти одного (`--merge`), а відбитки
+  зберегти в `*.hashes.bin` (`--save-hashes`) і врахувати пізніше (`--known`).
 * **import** – як у patch 6 (passive‑safe).
 Changes in **2025‑06‑09 patch 7 (offline de‑duplication)**
 ---------------------------------------------------------
@@ -17,24 +20,65 @@ Changes in **2025‑06‑09 patch 7 (offline de‑duplication)**
 from __future__ import annotations
 import argparse
 import base64
-import gzip
+import bisect
+import heapq
 import hashlib
+import io
 import json
 import logging
+import mmap
 import os
 import pathlib
 import queue
+import re
 import shutil
 import threading
 import urllib.parse
-from typing import Dict, Iterator, List, Set
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 import pika
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util import Retry
 from tqdm import tqdm
 
+try:  # ISA-L gzip: той самий API, але в рази швидше за stdlib
+    from isal import igzip as _gz
+    from isal import isal_zlib as _zlib
+    GZIP_LEVELS = range(0, 4)   # ISA-L: 0..3
+except ImportError:
+    import gzip as _gz
+    import zlib as _zlib
+    GZIP_LEVELS = range(0, 10)  # zlib: 0..9
+
+try:  # orjson (C) ~3× швидше за stdlib json і одразу віддає bytes
+    from orjson import dumps as _dumps, loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+    def _dumps(obj: object) -> bytes:
+        return json.dumps(obj).encode()
+
+try:  # ijson (yajl2_c) розбирає відповідь /get потоково, без списку в пам'яті
+    import ijson as _ijson
+except ImportError:
+    _ijson = None
+
+try:  # BLAKE3 (SIMD) помітно швидший на великих тілах
+    from blake3 import blake3 as _blake3
+    _BODY_HASH = "blake3"
+
+    def _body_digest(body: bytes) -> bytes:
+        return _blake3(body).digest(16)
+except ImportError:
+    _BODY_HASH = "blake2b"
+
+    def _body_digest(body: bytes) -> bytes:
+        return hashlib.blake2b(body, digest_size=16).digest()
+
 # --------------------------- constants -------------------------------------
-ALLOWED_PROPS = {
+ALLOWED_PROPS = frozenset({
     "content_type",
     "content_encoding",
     "delivery_mode",
@@ -48,10 +92,23 @@ ALLOWED_PROPS = {
     "user_id",
     "app_id",
     "cluster_id",
-}
+})
 MAX_PAGE_SIZE = 500      # RabbitMQ REST API upper limit
-DEFAULT_BATCH = 1        # with ack_requeue_true we pull 1 msg / request
+DEFAULT_BATCH = 256      # msgs per /get request (downgraded to 1 if rejected)
+MAX_GET_COUNT = 500      # upper bound for /get count; broker holds the whole batch
 SUFFIX = ".jsonl.gz"     # export file name suffix
+HASHES_SUFFIX = ".hashes.bin"  # dedup fingerprint sidecar
+DIGEST_SIZE = 16         # bytes per fingerprint in the sidecar
+GZ_BUFFER = 128 * 1024   # read/write buffer in front of GzipFile
+GZIP_LEVEL = 1           # JSON lines: level 9 is ~5% smaller for many times the CPU
+GZIP_WBITS = 31          # zlib wbits for a gzip header/trailer (mtime = 0)
+MEMBER_LINES = 64        # messages per gzip member in exported files
+MEMBER_MAX = 64 * GZ_BUFFER  # bigger members are streamed, not copied whole
+PUBLISH_BATCH = 1000     # publishes per tx_commit on import
+PROGRESS_STEP = 256      # msgs between shared progress-bar updates
+PIPELINE_DEPTH = 16      # max chunks in flight between dedup stages
+# "message_id": "..." без escape-послідовностей (json.dumps ставить пробіл після ':')
+MESSAGE_ID_RE = re.compile(rb'"message_id": ?"([^"\\]+)"')
 RESERVED_PREFIXES: tuple[str, ...] = (
     "amq.",                # RabbitMQ internal
     "reply_",              # RPC reply queues
@@ -59,29 +116,179 @@ RESERVED_PREFIXES: tuple[str, ...] = (
 )
 
 # --------------------------- helper functions -----------------------------
-def new_session(user: str, password: str) -> requests.Session:
+def new_session(user: str, password: str, pool: int = 10) -> requests.Session:
     s = requests.Session()
     s.auth = HTTPBasicAuth(user, password)
+    # пул з'єднань під кількість воркерів, щоб потоки не відкривали нові сокети
+    adapter = HTTPAdapter(
+        pool_connections=pool,
+        pool_maxsize=pool,
+        # allowed_methods=None — повторюємо й POST: /get з ack_requeue_true
+        # не змінює чергу, тож повтор безпечний (за замовчуванням POST виключено)
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=None,
+        ),
+    )
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
     s.headers.update({"Accept-Encoding": "gzip"})
     s.timeout = (15, 300)
     return s
 
+class GzipMemberWriter:
+    """Gzip file written as a chain of small, independently decodable members.
+
+    A multi-member file is still plain gzip for every reader, but lets dedup
+    copy whole members byte-for-byte instead of recompressing them.
+    """
+    def __init__(
+        self, path: pathlib.Path, level: int = GZIP_LEVEL, member_lines: int = MEMBER_LINES
+    ) -> None:
+        self._fh = open(path, "wb", buffering=GZ_BUFFER)
+        self._level = level
+        self._member_lines = member_lines
+        self._pending: List[bytes] = []
+    
+    def add(self, line: bytes) -> None:
+        """Queue one newline-terminated line; emits a member every *member_lines*."""
+        self._pending.append(line)
+        if len(self._pending) >= self._member_lines:
+            self._flush_member()
+    
+    def add_lines(self, lines: Iterable[bytes]) -> None:
+        for line in lines:
+            self.add(line)
+    
+    def write_member(self, raw: bytes) -> None:
+        """Append an already compressed gzip member as is."""
+        self._flush_member()
+        self._fh.write(raw)
+    
+    def _flush_member(self) -> None:
+        if not self._pending:
+            return
+        c = _zlib.compressobj(self._level, _zlib.DEFLATED, GZIP_WBITS)
+        self._fh.write(c.compress(b"".join(self._pending)))
+        self._fh.write(c.flush())
+        self._pending.clear()
+    
+    def close(self) -> None:
+        self._flush_member()
+        self._fh.close()
+    
+    def __enter__(self) -> "GzipMemberWriter":
+        return self
+    
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+def _iter_gzip_members(
+    fh: IO[bytes], limit: int = MEMBER_MAX
+) -> Iterator[Tuple[Optional[bytes], bytes]]:
+    """(compressed, decompressed) bytes of each member of a gzip stream.
+
+    A member that inflates past *limit* is never held whole: it comes out as
+    a run of (None, piece) pairs of about *limit* bytes each instead.
+    """
+    pending = b""
+    while True:
+        if not pending:
+            pending = fh.read(GZ_BUFFER)
+            if not pending:
+                return
+        d = _zlib.decompressobj(GZIP_WBITS)
+        comp: Optional[List[bytes]] = []  # None — member завеликий, не копіюємо
+        out: List[bytes] = []
+        size = 0
+        while True:
+            if pending:
+                piece = d.decompress(pending, limit)
+                tail = d.unused_data if d.eof else d.unconsumed_tail
+            else:
+                piece = d.flush()  # вхід скінчився: забираємо залишок із декомпресора
+                tail = b""
+            if comp is not None:
+                comp.append(pending[: len(pending) - len(tail)])
+            out.append(piece)
+            size += len(piece)
+            if size > limit:
+                comp = None
+            if comp is None and size:
+                yield None, b"".join(out)
+                out, size = [], 0
+            if d.eof:
+                pending = tail
+                break
+            if not pending:
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+            pending = tail or fh.read(GZ_BUFFER)
+        if comp is not None:
+            yield b"".join(comp), b"".join(out)
+
+def _is_member_framed(path: pathlib.Path) -> bool:
+    """True if the first gzip member ends within the first GZ_BUFFER bytes.
+
+    Old dumps are one huge member; those go through the streaming dedup path.
+    Framed files may still contain a huge member (e.g. an old dump appended
+    to a new one); _iter_gzip_members streams such members in pieces.
+    """
+    with open(path, "rb") as fh:
+        head = fh.read(GZ_BUFFER)
+    if not head:
+        return False
+    d = _zlib.decompressobj(GZIP_WBITS)
+    try:
+        d.decompress(head)
+    except _zlib.error:
+        return False
+    return d.eof
+
+def _open_gz_read(path: pathlib.Path, binary: bool = False) -> IO:
+    """Gzip reader with a large read buffer."""
+    buf = io.BufferedReader(_gz.open(path, "rb"), buffer_size=GZ_BUFFER)
+    if binary:
+        return buf
+    return io.TextIOWrapper(buf, encoding="utf-8")
+
+_EMPTY_PROPS = pika.BasicProperties()  # спільний для повідомлень без властивостей
+
 def props_from(obj: dict) -> pika.BasicProperties:
-    pr = {k: v for k, v in (obj.get("properties") or {}).items() if k in ALLOWED_PROPS}
-    return pika.BasicProperties(headers=obj.get("headers"), **pr)
+    props = obj.get("properties")
+    hdrs = obj.get("headers")
+    if not props and not hdrs:
+        return _EMPTY_PROPS
+    pr = {k: props[k] for k in props.keys() & ALLOWED_PROPS} if props else {}
+    return pika.BasicProperties(headers=hdrs, **pr)
 
-def _fingerprint(msg: dict) -> str:
-    """Uniqueness fingerprint: message_id if present else SHA256(payload)."""
+def _fingerprint(msg: dict) -> bytes:
+    """Uniqueness fingerprint: message_id if present else 128-bit hash of payload."""
     mid = (msg.get("properties") or {}).get("message_id")
     if mid:
-        return f"id:{mid}"
-    payload_field = "payload" if "payload" in msg else "payload_bytes"
-    body = (
-        msg[payload_field].encode()
-        if payload_field == "payload"
-        else base64.b64decode(msg[payload_field])
-    )
-    return "sha:" + hashlib.sha256(body).hexdigest()
+        return b"i" + str(mid).encode()
+    # base64 детермінований, тож хешуємо закодований рядок як є, без декодування
+    body = msg["payload"] if "payload" in msg else msg["payload_bytes"]
+    if isinstance(body, str):
+        body = body.encode("utf-8", "surrogatepass")
+    return b"s" + _body_digest(body)
+
+def _fast_message_id(line: bytes) -> Optional[bytes]:
+    """message_id straight from the raw JSON line, or None if full parse is needed."""
+    # ключ може бути і в headers — тоді лише повний розбір знає, чий він
+    if b'"headers"' in line or line.count(b'"message_id"') != 1:
+        return None
+    m = MESSAGE_ID_RE.search(line)
+    return m.group(1) if m else None
+
+def _iter_messages(r: requests.Response) -> Iterator[object]:
+    """Items of a /get response array, streamed from the socket when ijson is available."""
+    if _ijson is None:
+        yield from r.json()
+        return
+    r.raw.decode_content = True  # Accept-Encoding: gzip — розпаковує urllib3
+    yield from _ijson.items(r.raw, "item", use_float=True)
 
 # --------------------------- pagination ------------------------------------
 def iter_queue_pages(sess: requests.Session, api_root: str) -> Iterator[List[dict]]:
@@ -114,7 +321,12 @@ def export_queue(
     api_root: str,
     qinfo: dict,
     out_dir: pathlib.Path,
-    _batch: int,  # kept for signature but ignored (always 1)
+    batch: int,
+    bar: tqdm,
+    bar_lock: threading.Lock,
+    dedup: bool = False,
+    gzip_level: int = GZIP_LEVEL,
+    stop: Optional[threading.Event] = None,
 ) -> None:
     vhost: str = qinfo["vhost"]
     qname: str = qinfo["name"]
@@ -129,9 +341,10 @@ def export_queue(
     q_enc = urllib.parse.quote(qname, safe="")
     url = f"{api_root}/queues/{v_enc}/{q_enc}/get"
     
-    # ВИПРАВЛЕННЯ: count повинен бути 1, а не більше при ack_requeue_true
+    # Сучасний RabbitMQ підтримує count > 1 разом з ack_requeue_true;
+    # якщо брокер відхиляє пакетний запит — знижуємо count до 1.
     payload = {
-        "count": 1,                     # ВАЖЛИВО: завжди 1 для ack_requeue_true
+        "count": max(1, min(batch, MAX_GET_COUNT)),
         "ackmode": "ack_requeue_true",  # queue stays intact
         "encoding": "auto",             # text base64
         #"truncate": 0,                  # не обрізати повідомлення
@@ -140,44 +353,62 @@ def export_queue(
     out_path = out_dir / v_enc / f"{q_enc}{SUFFIX}"
     out_path.parent.mkdir(parents=True, exist_ok=True)
     
-    saved = 0
-    consecutive_empty = 0  # лічильник порожніх відповідей
-    max_empty_attempts = 3  # максимум спроб отримати порожню відповідь
+    fetched = 0  # отримано з брокера (разом із дублікатами)
+    saved = 0    # записано у файл
+    # одна черга = один файл = один воркер, тож set не потребує блокування
+    seen: Optional[Set[bytes]] = set() if dedup else None
+    unreported = 0  # ще не додано до спільного прогрес-бару
     
-    bar = tqdm(total=expected, desc=f"{vhost}/{qname}", unit="msg", leave=False)
-    
-    with gzip.open(out_path, "wt") as gz:
-        while saved < expected:
+    with GzipMemberWriter(out_path, gzip_level) as gz:
+        while fetched < expected and not (stop and stop.is_set()):
             try:
-                r = sess.post(url, json=payload)
-                r.raise_for_status()
-                msgs = r.json()
-                
-                # ВИПРАВЛЕННЯ: перевірка на порожню відповідь
-                if not msgs or len(msgs) == 0:
-                    consecutive_empty += 1
-                    if consecutive_empty >= max_empty_attempts:
-                        logging.warning("⚠️ %s/%s — отримано %d порожніх відповідей поспіль, зупиняємо", 
-                                      vhost, qname, consecutive_empty)
-                        break
-                    continue
-                
-                consecutive_empty = 0  # скидаємо лічильник
-                
-                # ВИПРАВЛЕННЯ: додаткова перевірка на валідність повідомлень
-                for m in msgs:
-                    if not m or not isinstance(m, dict):
-                        logging.warning("⚠️ %s/%s — отримано недійсне повідомлення: %r", vhost, qname, m)
-                        continue
-                    
-                    # Перевіряємо наявність payload
-                    if "payload" not in m and "payload_bytes" not in m:
-                        logging.warning("⚠️ %s/%s — повідомлення без payload: %r", vhost, qname, m)
+                # не просимо більше, ніж лишилось очікуваних (count лише зменшується,
+                # тож перехід на count=1 зберігається)
+                payload["count"] = min(payload["count"], expected - fetched)
+                got = 0
+                last: object = None
+                # stream=True: повідомлення розбираються по мірі надходження
+                with sess.post(url, json=payload, stream=True) as r:
+                    if r.status_code == 400 and payload["count"] > 1:
+                        logging.warning("⚠️ %s/%s — брокер відхилив count=%d, переходимо на count=1",
+                                        vhost, qname, payload["count"])
+                        payload["count"] = 1
                         continue
+                    r.raise_for_status()
                     
-                    gz.write(json.dumps(m) + "\n")
-                    saved += 1
-                    bar.update(1)
+                    # ВИПРАВЛЕННЯ: додаткова перевірка на валідність повідомлень
+                    for m in _iter_messages(r):
+                        got += 1
+                        last = m
+                        if not m or not isinstance(m, dict):
+                            logging.warning("⚠️ %s/%s — отримано недійсне повідомлення: %r", vhost, qname, m)
+                            continue
+                        
+                        # Перевіряємо наявність payload
+                        if "payload" not in m and "payload_bytes" not in m:
+                            logging.warning("⚠️ %s/%s — повідомлення без payload: %r", vhost, qname, m)
+                            continue
+                        
+                        fetched += 1
+                        unreported += 1
+                        if seen is not None:
+                            fp = _fingerprint(m)
+                            if fp in seen:
+                                continue
+                            seen.add(fp)
+                        
+                        gz.add(_dumps(m) + b"\n")
+                        saved += 1
+                
+                if unreported >= PROGRESS_STEP:
+                    with bar_lock:
+                        bar.update(unreported)
+                    unreported = 0
+                
+                # Кінець черги: брокер нічого не віддав, або message_count
+                # останнього повідомлення (скільки лишилось у черзі) дорівнює 0.
+                if got == 0 or (isinstance(last, dict) and last.get("message_count", 1) == 0):
+                    break
                     
             except requests.exceptions.RequestException as e:
                 logging.error("❌ %s/%s — помилка HTTP запиту: %s", vhost, qname, e)
@@ -189,9 +420,16 @@ def export_queue(
                 logging.error("❌ %s/%s — неочікувана помилка: %s", vhost, qname, e)
                 break
     
-    bar.close()
+    if unreported:
+        with bar_lock:
+            bar.update(unreported)
     
-    if saved > 0:
+    if stop and stop.is_set() and fetched < expected:
+        logging.warning("⚠️ %s/%s — експорт перервано, файл неповний (%d msg)", vhost, qname, saved)
+    elif saved > 0 and dedup:
+        logging.info("✓ %s/%s — %d msg exported, %d duplicates skipped",
+                     vhost, qname, saved, fetched - saved)
+    elif saved > 0:
         logging.info("✓ %s/%s — %d msg exported (duplicates possible)", vhost, qname, saved)
     else:
         logging.warning("⚠️ %s/%s — не вдалося експортувати жодного повідомлення", vhost, qname)
@@ -204,7 +442,7 @@ def export_all(args: argparse.Namespace) -> None:
     out_dir = pathlib.Path(args.out)
     out_dir.mkdir(parents=True, exist_ok=True)
     
-    sess = new_session(args.user, args.password)
+    sess = new_session(args.user, args.password, pool=args.parallel)
     api_root = f"http://{args.host}:{args.http_port}/api"
     
     # Перевірка підключення
@@ -233,66 +471,293 @@ def export_all(args: argparse.Namespace) -> None:
     
     logging.info("📋 Знайдено %d черг з повідомленнями для експорту", len(non_empty_queues))
     
-    work: "queue.Queue[dict]" = queue.Queue()
-    for q in non_empty_queues:  # Додаємо тільки непорожні черги
-        work.put(q)
-    
-    def worker() -> None:
-        while True:
-            try:
-                qi = work.get_nowait()
-            except queue.Empty:
-                break
-            try:
-                export_queue(sess, api_root, qi, out_dir, args.batch)
-            except Exception as e:
-                logging.error("❌ Помилка при експорті черги %s/%s: %s", 
-                            qi.get("vhost", "?"), qi.get("name", "?"), e)
-            finally:
-                work.task_done()
-    
-    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.parallel)]
-    for t in threads:
-        t.start()
+    # один спільний бар на весь експорт; воркери оновлюють його пачками
+    bar = tqdm(
+        total=sum(q["messages"] for q in non_empty_queues),
+        desc="export",
+        unit="msg",
+        mininterval=0.5,
+        disable=None,  # вимкнено, якщо stderr не TTY
+    )
+    bar_lock = threading.Lock()
+    
+    if args.batch > MAX_GET_COUNT:
+        logging.warning("⚠️ --batch %d завеликий для /get, використовуємо %d",
+                        args.batch, MAX_GET_COUNT)
+    
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=args.parallel, thread_name_prefix="rmq-exp") as ex:
+        futs = {
+            ex.submit(
+                export_queue, sess, api_root, q, out_dir, args.batch, bar, bar_lock,
+                args.dedup, args.gzip_level, stop,
+            ): q
+            for q in non_empty_queues
+        }
+        try:
+            for f in as_completed(futs):
+                e = f.exception()
+                if e is not None:
+                    qi = futs[f]
+                    logging.error("❌ Помилка при експорті черги %s/%s: %s", 
+                                qi.get("vhost", "?"), qi.get("name", "?"), e)
+        except BaseException:
+            # Ctrl-C: скасовуємо черги, що ще не стартували, і зупиняємо поточні
+            stop.set()
+            ex.shutdown(wait=False, cancel_futures=True)
+            bar.close()
+            raise
     
-    work.join()
+    bar.close()
     logging.info("✅ Export finished → %s", out_dir)
 
 # --------------------------- dedup logic ----------------------------------
-def dedup_file(path: pathlib.Path, inplace: bool) -> None:
+def _sidecar_key(fp: bytes) -> bytes:
+    """Fixed-size form of a fingerprint, as stored in the .hashes.bin sidecar."""
+    return hashlib.blake2b(fp, digest_size=DIGEST_SIZE).digest()
+
+def _sidecar_header() -> bytes:
+    # тіла без message_id хешуються _body_digest, тож алгоритм — частина формату
+    return f"rmqfp1 {_BODY_HASH}\n".encode()
+
+class DigestIndex:
+    """Sorted fingerprints from a .hashes.bin sidecar, mmapped read-only.
+
+    Lookup is a binary search over the raw file, ~16 B per entry instead of a
+    Python object per entry in a set.
+    """
+    def __init__(self, path: pathlib.Path) -> None:
+        with open(path, "rb") as fh:
+            header = fh.readline()
+            if header != _sidecar_header():
+                raise ValueError(f"{path}: unsupported sidecar header {header!r}")
+            self._offset = len(header)
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self._n = (len(self._mm) - self._offset) // DIGEST_SIZE
+    
+    def __len__(self) -> int:
+        return self._n
+    
+    def __getitem__(self, i: int) -> bytes:
+        o = self._offset + i * DIGEST_SIZE
+        return self._mm[o:o + DIGEST_SIZE]
+    
+    def __iter__(self) -> Iterator[bytes]:
+        return (self[i] for i in range(self._n))
+    
+    def __contains__(self, key: bytes) -> bool:
+        i = bisect.bisect_left(self, key)
+        return i < self._n and self[i] == key
+
+def write_sidecar(
+    path: pathlib.Path, seen: Iterable[bytes], known: Sequence[DigestIndex] = ()
+) -> None:
+    """Write the sorted union of *seen* fingerprints and *known* sidecars to *path*."""
+    keys = sorted({_sidecar_key(fp) for fp in seen})
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as fh:
+        fh.write(_sidecar_header())
+        prev = None
+        written = 0
+        for key in heapq.merge(keys, *known):
+            if key != prev:
+                fh.write(key)
+                prev = key
+                written += 1
+    tmp.replace(path)
+    logging.info("✓ %s: %d fingerprints saved", path.name, written)
+
+def _chunk_message_ids(lines: List[bytes]) -> Optional[List[bytes]]:
+    """message_id of every line via one regex pass over the chunk, or None.
+
+    Without headers "message_id" can only be a key of `properties`, i.e. at
+    most once per line; so as many matches as lines means one id per line.
+    """
+    blob = b"".join(lines)
+    if b'"headers"' in blob or blob.count(b'"message_id"') != len(lines):
+        return None
+    ids = MESSAGE_ID_RE.findall(blob)
+    return ids if len(ids) == len(lines) else None
+
+def _line_fingerprint(line: bytes) -> Optional[bytes]:
+    try:
+        mid = _fast_message_id(line)
+        return b"i" + mid if mid else _fingerprint(_loads(line))
+    except json.JSONDecodeError as e:
+        logging.warning("⚠️ Пропускаємо недійсний JSON: %s", e)
+        return None
+
+def _dedup_lines(
+    lines: List[bytes], seen: Set[bytes], known: Sequence[DigestIndex] = ()
+) -> List[bytes]:
+    """Lines from *lines* whose fingerprint is not yet in *seen* or *known* (updates *seen*)."""
+    ids = _chunk_message_ids(lines)
+    if ids is not None:  # типовий випадок: у всіх рядків є message_id, JSON не розбираємо
+        fps: Iterable[Optional[bytes]] = (b"i" + mid for mid in ids)
+    else:
+        fps = map(_line_fingerprint, lines)
+    
+    out: List[bytes] = []
+    for line, fp in zip(lines, fps):
+        if fp is None:
+            continue
+        if fp in seen:
+            continue
+        seen.add(fp)
+        if known:
+            key = _sidecar_key(fp)
+            if any(key in idx for idx in known):
+                continue
+        out.append(line)
+    return out
+
+def dedup_file(
+    path: pathlib.Path,
+    inplace: bool,
+    seen: Optional[Set[bytes]] = None,
+    known: Sequence[DigestIndex] = (),
+    gzip_level: int = GZIP_LEVEL,
+) -> bool:
+    """Drop duplicate lines from *path*; False if the file could not be processed.
+
+    *seen* may be shared between calls to dedup several files against each
+    other; fingerprints in *known* sidecars are treated as already seen.
+    """
     if not path.exists():
         logging.error("File %s not found", path)
-        return
+        return False
     
     tmp_path = path.with_suffix(".dedup.jsonl.gz") if not inplace else path.with_suffix(".tmp")
     total_read = 0
     kept = 0
-    seen: Set[str] = set()
+    if seen is None:
+        seen = set()
     
     bar = tqdm(desc=f"dedup {path.name}", unit="msg", leave=False)
     
-    with gzip.open(path, "rt") as src, gzip.open(tmp_path, "wt") as dst:
-        for line in src:
-            total_read += 1
-            try:
-                obj = json.loads(line)
-                fp = _fingerprint(obj)
-                if fp in seen:
-                    continue
-                seen.add(fp)
-                dst.write(line)
-                kept += 1
-                bar.update()
-            except json.JSONDecodeError as e:
-                logging.warning("⚠️ Пропускаємо недійсний JSON: %s", e)
-                continue
+    # Конвеєр: читання+gunzip → fingerprint → gzip+запис (головний потік).
+    # zlib / hashlib відпускають GIL, тож стадії справді перекриваються.
+    # Між стадіями ходять пачки рядків, а не окремі рядки; для файлів із
+    # дрібними gzip-member-ами пачка = member разом із його стиснутими байтами.
+    Chunk = Tuple[Optional[bytes], List[bytes]]
+    raw_q: "queue.Queue[Optional[Chunk]]" = queue.Queue(maxsize=PIPELINE_DEPTH)
+    out_q: "queue.Queue[Optional[Chunk]]" = queue.Queue(maxsize=PIPELINE_DEPTH)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    framed = _is_member_framed(path)
+    
+    def reader() -> None:
+        try:
+            if framed:
+                with open(path, "rb") as fh:
+                    carry = b""  # хвіст рядка, розірваного між member-ами
+                    for raw, data in _iter_gzip_members(fh):
+                        if stop.is_set():
+                            break
+                        if carry:
+                            data, raw = carry + data, None
+                        cut = data.rfind(b"\n") + 1
+                        data, carry = data[:cut], data[cut:]
+                        if carry:
+                            raw = None
+                        raw_q.put((raw, data.splitlines(keepends=True)))
+                    if carry:
+                        raw_q.put((None, [carry]))
+            else:
+                with _open_gz_read(path, binary=True) as src:
+                    while not stop.is_set():
+                        chunk = src.readlines(GZ_BUFFER)
+                        if not chunk:
+                            break
+                        raw_q.put((None, chunk))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            raw_q.put(None)
+    
+    def hasher() -> None:
+        nonlocal total_read
+        try:
+            while (item := raw_q.get()) is not None:
+                raw, lines = item
+                total_read += len(lines)
+                survivors = _dedup_lines(lines, seen, known)
+                # member вцілів повністю — копіюємо стиснуті байти без перепакування
+                out_q.put((raw if len(survivors) == len(lines) else None, survivors))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            out_q.put(None)
+    
+    with GzipMemberWriter(tmp_path, gzip_level) as dst:
+        threads = [
+            threading.Thread(target=reader, name="dedup-read", daemon=True),
+            threading.Thread(target=hasher, name="dedup-hash", daemon=True),
+        ]
+        for t in threads:
+            t.start()
+        try:
+            while (item := out_q.get()) is not None:
+                raw, lines = item
+                if raw is not None:
+                    dst.write_member(raw)
+                else:
+                    dst.add_lines(lines)
+                kept += len(lines)
+                bar.update(len(lines))
+        finally:
+            # розблоковуємо стадії, що могли застрягти на повній черзі
+            stop.set()
+            for t in threads:
+                while t.is_alive():
+                    for q in (raw_q, out_q):
+                        try:
+                            q.get_nowait()
+                        except queue.Empty:
+                            pass
+                    t.join(0.05)
     
     bar.close()
     
+    if errors:
+        raise errors[0]
+    
     if inplace:
         shutil.move(tmp_path, path)
     
     logging.info("✓ %s: read %d, kept %d, removed %d", path.name, total_read, kept, total_read - kept)
+    return True
+
+def dedup_all(args: argparse.Namespace) -> None:
+    known_paths = [pathlib.Path(k) for k in args.known or ()]
+    # sidecar самого вхідного файлу позначив би всі його рядки як уже бачені
+    own = {pathlib.Path(f).with_suffix(HASHES_SUFFIX).resolve() for f in args.files}
+    for k in known_paths:
+        if k.resolve() in own:
+            logging.error("❌ %s — це sidecar одного з вхідних файлів; "
+                          "з --known він видалив би всі рядки цього файлу", k)
+            return
+    known: List[DigestIndex] = []
+    for k in known_paths:
+        try:
+            known.append(DigestIndex(k))
+        except (OSError, ValueError) as e:
+            logging.error("❌ Не вдалося відкрити --known %s: %s", k, e)
+            return
+    shared: Optional[Set[bytes]] = set() if args.merge else None
+    merged: List[pathlib.Path] = []  # оброблені файли в режимі --merge
+    for name in args.files:
+        path = pathlib.Path(name)
+        seen = shared if shared is not None else set()
+        # необроблений файл не повинен дати (порожній) sidecar, якому потім повірить --known
+        if not dedup_file(path, args.inplace, seen, known, args.gzip_level):
+            continue
+        if shared is not None:
+            merged.append(path)
+        elif args.save_hashes:
+            write_sidecar(path.with_suffix(HASHES_SUFFIX), seen, known)
+    if args.save_hashes and merged:
+        write_sidecar(merged[0].with_suffix(HASHES_SUFFIX), shared, known)
 
 # --------------------------- import logic (unchanged from patch‑6) --------
 def decode_legacy_vhost(raw: str, legacy: bool) -> str:
@@ -313,16 +778,87 @@ def import_all(args: argparse.Namespace) -> None:
         logging.error("Input directory '%s' not found.", in_dir)
         return
     
-    conn_cache: Dict[str, pika.BlockingConnection] = {}
+    # pika.BlockingConnection не потокобезпечний: у кожного воркера свій кеш
+    # з'єднань по vhost; усі з'єднання запам'ятовуємо, щоб закрити в кінці.
+    local = threading.local()
+    all_conns: List[pika.BlockingConnection] = []
+    conns_lock = threading.Lock()
+    stop = threading.Event()
     
     def channel_for(vhost: str):
+        if not hasattr(local, "conns"):
+            local.conns = {}
+        conn_cache: Dict[str, pika.BlockingConnection] = local.conns
         if vhost not in conn_cache:
             creds = pika.PlainCredentials(args.user, args.password)
             conn_cache[vhost] = pika.BlockingConnection(
                 pika.ConnectionParameters(args.host, args.amqp_port, vhost, creds)
             )
+            with conns_lock:
+                all_conns.append(conn_cache[vhost])
         return conn_cache[vhost].channel()
     
+    def restore(vhost: str, qname: str, f: pathlib.Path) -> None:
+        ch = channel_for(vhost)
+        if args.declare_queue:
+            try:
+                ch.queue_declare(queue=qname, passive=True)
+            except pika.exceptions.ChannelClosedByBroker as e:
+                if e.reply_code == 404:
+                    ch = channel_for(vhost)
+                    ch.queue_declare(queue=qname, durable=True, passive=False)
+                else:
+                    ch = channel_for(vhost)
+        
+        # Публікуємо в транзакції і комітимо пачками: один round-trip на
+        # publish_batch повідомлень, і брокер підтверджує, що все прийнято.
+        ch.tx_select()
+        total = 0
+        pending = 0
+        
+        with _open_gz_read(f) as gz:
+            for line in gz:
+                if stop.is_set():
+                    break
+                try:
+                    obj = _loads(line)
+                    payload_field = "payload" if "payload" in obj else "payload_bytes"
+                    
+                    if payload_field == "payload":
+                        # payload - це рядок, який потрібно закодувати
+                        body = obj[payload_field].encode()
+                    else:
+                        # payload_bytes - це base64 encoded рядок
+                        body = base64.b64decode(obj[payload_field])
+                    
+                    ch.basic_publish("", qname, body, props_from(obj))
+                    pending += 1
+                except (json.JSONDecodeError, KeyError, base64.binascii.Error) as e:
+                    logging.warning("⚠️ Пропускаємо недійсне повідомлення: %s", e)
+                    continue
+                
+                if pending >= args.publish_batch:
+                    ch.tx_commit()
+                    total += pending
+                    with bar_lock:
+                        bar.update(pending)
+                    pending = 0
+        
+        if stop.is_set():
+            # незакомічена пачка відкочується разом із закриттям каналу
+            ch.close()
+            logging.warning("⚠️ %s/%s — імпорт перервано, відновлено лише %d msg",
+                            vhost, qname, total)
+            return
+        if pending:
+            ch.tx_commit()
+            total += pending
+            with bar_lock:
+                bar.update(pending)
+        ch.close()
+        logging.info("✓ %s/%s — %d msg restored", vhost, qname, total)
+    
+    tasks = []
     for vdir in in_dir.iterdir():
         if not vdir.is_dir():
             continue
@@ -339,45 +875,31 @@ def import_all(args: argparse.Namespace) -> None:
                 logging.info("Skipping reserved/internal queue %s", qname)
                 continue
             
-            ch = channel_for(vhost)
-            if args.declare_queue:
-                try:
-                    ch.queue_declare(queue=qname, passive=True)
-                except pika.exceptions.ChannelClosedByBroker as e:
-                    if e.reply_code == 404:
-                        ch = channel_for(vhost)
-                        ch.queue_declare(queue=qname, durable=True, passive=False)
-                    else:
-                        ch = channel_for(vhost)
-            
-            total = 0
-            bar = tqdm(desc=f"restore {vhost}/{qname}", unit="msg", leave=False)
-            
-            with gzip.open(f, "rt") as gz:
-                for line in gz:
-                    try:
-                        obj = json.loads(line)
-                        payload_field = "payload" if "payload" in obj else "payload_bytes"
-                        
-                        if payload_field == "payload":
-                            # payload - це рядок, який потрібно закодувати
-                            body = obj[payload_field].encode()
-                        else:
-                            # payload_bytes - це base64 encoded рядок
-                            body = base64.b64decode(obj[payload_field])
-                        
-                        ch.basic_publish("", qname, body, props_from(obj))
-                        total += 1
-                        bar.update()
-                    except (json.JSONDecodeError, KeyError, base64.binascii.Error) as e:
-                        logging.warning("⚠️ Пропускаємо недійсне повідомлення: %s", e)
-                        continue
-            
-            bar.close()
-            logging.info("✓ %s/%s — %d msg restored", vhost, qname, total)
+            tasks.append((vhost, qname, f))
+    
+    # один спільний бар на весь імпорт (як в export_all): паралельні бари
+    # на одній позиції затирали б один одного
+    bar = tqdm(desc="import", unit="msg", mininterval=0.5, disable=None)
+    bar_lock = threading.Lock()
     
-    for conn in conn_cache.values():
-        conn.close()
+    try:
+        with ThreadPoolExecutor(max_workers=args.parallel, thread_name_prefix="rmq-imp") as ex:
+            futs = {ex.submit(restore, *t): t for t in tasks}
+            try:
+                for fut in as_completed(futs):
+                    e = fut.exception()
+                    if e is not None:
+                        vhost, qname, _ = futs[fut]
+                        logging.error("❌ Помилка при імпорті черги %s/%s: %s", vhost, qname, e)
+            except BaseException:
+                # Ctrl-C: скасовуємо черги, що ще не стартували, і зупиняємо поточні
+                stop.set()
+                ex.shutdown(wait=False, cancel_futures=True)
+                raise
+    finally:
+        bar.close()
+        for conn in all_conns:
+            conn.close()
     
     logging.info("✅ Import finished.")
 
@@ -398,7 +920,11 @@ def build_parser() -> argparse.ArgumentParser:
     exp.add_argument("-o", "--out", default="rmq_http_dump")
     exp.add_argument("--vhost", action="append", help="Export only these vhosts")
     exp.add_argument("--parallel", type=int, default=os.cpu_count() or 8)
-    exp.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="/get batch size")
+    exp.add_argument("--batch", type=int, default=DEFAULT_BATCH, help=f"/get batch size (capped at {MAX_GET_COUNT})")
+    exp.add_argument("--dedup", action="store_true",
+                     help="Skip duplicates while exporting (no separate dedup pass needed)")
+    exp.add_argument("--gzip-level", type=int, default=GZIP_LEVEL, choices=GZIP_LEVELS,
+                     metavar="LEVEL", help="Output compression level (0-3 with isal, 0-9 with stdlib gzip)")
     
     # Import command
     imp = sub.add_parser("import", help="Restore from dump")
@@ -411,12 +937,27 @@ def build_parser() -> argparse.ArgumentParser:
     imp.add_argument("--vhost", action="append", help="Import only these vhosts")
     imp.add_argument("--declare-queue", action="store_true", help="Create queue if missing")
     imp.add_argument("--legacy-sanitize", action="store_true", help="Decode old '_' names")
+    imp.add_argument("--parallel", type=int, default=os.cpu_count() or 8)
+    imp.add_argument("--publish-batch", type=int, default=PUBLISH_BATCH,
+                     help="Messages per broker-confirmed commit")
     
     # Dedup command
-    dedup = sub.add_parser("dedup", help="Remove duplicates from exported file")
-    dedup.add_argument("file", help="Path to .jsonl.gz file to deduplicate")
+    dedup = sub.add_parser("dedup", help="Remove duplicates from exported file(s)")
+    dedup.add_argument("files", nargs="+", metavar="file",
+                      help="Path to .jsonl.gz file(s) to deduplicate")
     dedup.add_argument("--inplace", action="store_true", 
                       help="Modify file in-place instead of creating .dedup version")
+    dedup.add_argument("--merge", action="store_true",
+                      help="Also drop duplicates across the given files (first occurrence wins)")
+    dedup.add_argument("--known", action="append",
+                      help=f"Treat fingerprints from this {HASHES_SUFFIX} sidecar as already seen")
+    dedup.add_argument("--save-hashes", action="store_true",
+                      help=f"Write fingerprints to a {HASHES_SUFFIX} sidecar next to each file "
+                           "(next to the first processed file with --merge)")
+    dedup.add_argument("--gzip-level", type=int, default=GZIP_LEVEL, choices=GZIP_LEVELS,
+                      metavar="LEVEL",
+                      help="Output compression level (0-3 with isal, 0-9 with stdlib gzip); "
+                           "members copied unchanged keep their original level")
     
     return p
 
@@ -435,7 +976,7 @@ def main() -> None:
     elif args.mode == "import":
         import_all(args)
     elif args.mode == "dedup":
-        dedup_file(pathlib.Path(args.file), args.inplace)
+        dedup_all(args)
 
 if __name__ == "__main__":
     main()